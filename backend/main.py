@@ -1,13 +1,24 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
+from collections import OrderedDict
+from threading import Lock
 import os
+import re
+import tempfile
+import string
+import time
+import hmac
+import hashlib
 import logging
 import asyncio
-from utils.rag_pipeline import build_vectorstore, ask_question
+import aiofiles
+from utils.rag_pipeline import build_vectorstore, ask_question, stream_question, document_hash, get_llm
 from utils.pdf_processing import extract_text_from_pdf
+from utils.embeddings import get_embeddings
 import secrets
 
 # Set up logging
@@ -34,8 +45,119 @@ users = {
     "user": "user123"
 }
 
-# Global variable to store the vectorstore
-vectorstore = None
+# Recently verified credentials, keyed by an HMAC of "username:password" so plain
+# passwords are never held as cache keys. Entries expire after AUTH_CACHE_TTL seconds.
+AUTH_CACHE_TTL = 60
+AUTH_CACHE_SIZE = 256
+_AUTH_CACHE_SECRET = secrets.token_bytes(32)
+_auth_cache: "OrderedDict[str, tuple]" = OrderedDict()
+# authenticate_user is a sync dependency, so FastAPI calls it from a threadpool
+_auth_cache_lock = Lock()
+
+def _check_credentials(username: str, password: str) -> bool:
+    """Check a username/password pair in constant time with respect to the password."""
+    expected = users.get(username)
+    # Compare against an empty password for unknown users so both cases do the same work
+    password_matches = secrets.compare_digest(password.encode(), (expected or "").encode())
+    return expected is not None and password_matches
+
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Bounded LRU cache of answers keyed by (normalized query, temperature, vectorstore id)
+ANSWER_CACHE_SIZE = 512
+_answer_cache: "OrderedDict[tuple, str]" = OrderedDict()
+# /chat/stream touches the cache from Starlette's threadpool while uploads clear it on the event loop
+_answer_cache_lock = Lock()
+
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for cache lookups (case, punctuation and whitespace insensitive)."""
+    return re.sub(r'\s+', ' ', query.lower().strip().translate(_PUNCTUATION_TABLE))
+
+def _answer_cache_key(query: str, temperature: float, vectorstore) -> tuple:
+    return (normalize_query(query), round(temperature, 2), id(vectorstore))
+
+def _get_cached_answer(key: tuple) -> Optional[str]:
+    with _answer_cache_lock:
+        answer = _answer_cache.get(key)
+        if answer is not None:
+            _answer_cache.move_to_end(key)
+    if answer is not None:
+        logger.info("Answer cache hit")
+    return answer
+
+def _cache_answer(key: tuple, answer: str) -> None:
+    with _answer_cache_lock:
+        _answer_cache[key] = answer
+        if len(_answer_cache) > ANSWER_CACHE_SIZE:
+            _answer_cache.popitem(last=False)
+
+def _cache_answer_if_current(key: tuple, answer: str, vectorstore) -> None:
+    """Cache an answer unless an upload replaced the document while it was being generated."""
+    if vectorstore is app.state.vectorstore:
+        _cache_answer(key, answer)
+
+def _clear_answer_cache() -> None:
+    with _answer_cache_lock:
+        _answer_cache.clear()
+
+def _sse_frame(data: str, event: Optional[str] = None) -> str:
+    """Format a Server-Sent Events frame, splitting multi-line data across data fields."""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+@app.on_event("startup")
+async def init_state():
+    """Set up shared document state on app.state."""
+    # The active document's vectorstore; only ever replaced by a fully built one
+    app.state.vectorstore = None
+    # Serializes vectorstore builds and their publication
+    app.state.vs_lock = asyncio.Lock()
+    # In-flight builds keyed by document hash, so concurrent uploads of one document share a build
+    app.state.build_tasks = {}
+
+@app.on_event("startup")
+async def preload_models():
+    """Load the embeddings model and LLM at startup so the first upload and chat don't pay the cold start."""
+    logger.info("Preloading embeddings model...")
+    await asyncio.to_thread(get_embeddings)
+    logger.info("Preloading LLM...")
+    await asyncio.to_thread(get_llm)
+
+async def _build_and_activate(text: str, doc_hash: str):
+    """Build a vectorstore under the state lock and make it the active document."""
+    async with app.state.vs_lock:
+        new_vectorstore = await asyncio.to_thread(build_vectorstore, text, doc_hash)
+        if new_vectorstore is not None:
+            app.state.vectorstore = new_vectorstore
+            # Cached answers belong to the previous document
+            _clear_answer_cache()
+        return new_vectorstore
+
+async def _load_document(text: str):
+    """
+    Build and activate the vectorstore for a document, joining an in-flight build of the same document.
+    
+    Args:
+        text (str): Extracted document text
+        
+    Returns:
+        FAISS: The active vectorstore or None if the build failed
+    """
+    # Hashing a large document takes a while, so keep it off the event loop
+    doc_hash = await asyncio.to_thread(document_hash, text)
+    task = app.state.build_tasks.get(doc_hash)
+    if task is None:
+        task = asyncio.create_task(_build_and_activate(text, doc_hash))
+        app.state.build_tasks[doc_hash] = task
+        task.add_done_callback(lambda _: app.state.build_tasks.pop(doc_hash, None))
+    else:
+        logger.info(f"Joining in-progress build for document {doc_hash}")
+    # Shield so one client disconnecting doesn't cancel a build others are waiting on
+    return await asyncio.shield(task)
 
 # Request model for chat
 class ChatRequest(BaseModel):
@@ -68,8 +190,31 @@ chat_history: List[str] = []
 
 def authenticate_user(credentials: HTTPBasicCredentials = Depends(security)):
     """Authenticate user with HTTP Basic Auth"""
+    cache_key = hmac.new(
+        _AUTH_CACHE_SECRET,
+        f"{credentials.username}:{credentials.password}".encode(),
+        hashlib.sha256
+    ).hexdigest()
+    now = time.monotonic()
+    
+    with _auth_cache_lock:
+        # Drop expired entries; they are in insertion order, so stop at the first fresh one
+        while _auth_cache:
+            _, (_, verified_at) = next(iter(_auth_cache.items()))
+            if now - verified_at < AUTH_CACHE_TTL:
+                break
+            _auth_cache.popitem(last=False)
+        
+        cached = _auth_cache.get(cache_key)
+        if cached is not None:
+            return cached[0]
+    
     # In a real application, you would check against a database
-    if credentials.username in users and users[credentials.username] == credentials.password:
+    if _check_credentials(credentials.username, credentials.password):
+        with _auth_cache_lock:
+            _auth_cache[cache_key] = (credentials.username, now)
+            if len(_auth_cache) > AUTH_CACHE_SIZE:
+                _auth_cache.popitem(last=False)
         return credentials.username
     raise HTTPException(
         status_code=401,
@@ -91,7 +236,7 @@ async def login(request: LoginRequest):
     """
     logger.info(f"Login attempt for user: {request.username}")
     
-    if request.username in users and users[request.username] == request.password:
+    if _check_credentials(request.username, request.password):
         logger.info(f"Successful login for user: {request.username}")
         return {"success": True, "message": "Login successful"}
     else:
@@ -116,12 +261,21 @@ async def chat(request: ChatRequest, credentials: str = Depends(authenticate_use
     logger.info(f"Received chat request from {credentials}: {user_query} with temperature {temperature}")
     
     # If we have a vectorstore, use RAG to answer the question
+    vectorstore = app.state.vectorstore
     if vectorstore:
+        cache_key = _answer_cache_key(user_query, temperature, vectorstore)
         try:
-            response_text = ask_question(vectorstore, user_query, temperature)
-            # Ensure we always have a response
-            if not response_text or response_text.strip() == "":
-                response_text = "I couldn't find relevant information to answer your question."
+            response_text = _get_cached_answer(cache_key)
+            if response_text is None:
+                # Generate in a worker thread so the event loop keeps serving other requests.
+                # Only generated answers are cached; fallback and error text is not
+                response_text = await asyncio.to_thread(
+                    ask_question, vectorstore, user_query, temperature,
+                    on_answer=lambda answer: _cache_answer_if_current(cache_key, answer, vectorstore)
+                )
+                # Ensure we always have a response
+                if not response_text or response_text.strip() == "":
+                    response_text = "I couldn't find relevant information to answer your question."
         except Exception as e:
             logger.error(f"Error processing query: {e}")
             response_text = f"Error processing query: {str(e)}"
@@ -136,6 +290,53 @@ async def chat(request: ChatRequest, credentials: str = Depends(authenticate_use
     # Always return a response
     return {"response": response_text}
 
+# ✅ Streaming Chat Endpoint
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, credentials: str = Depends(authenticate_user)):
+    """
+    Chat endpoint that streams the answer as Server-Sent Events while it is generated.
+    
+    Args:
+        request (ChatRequest): Contains the user's query and optional temperature setting
+        credentials (str): Authenticated user
+        
+    Returns:
+        StreamingResponse: text/event-stream of answer pieces, closed by an "end" event
+    """
+    user_query = request.query
+    temperature = request.temperature if request.temperature is not None else 0.1
+    logger.info(f"Received streaming chat request from {credentials}: {user_query} with temperature {temperature}")
+    
+    # Bind the current document so a concurrent upload can't change it mid-stream
+    current_vectorstore = app.state.vectorstore
+    cache_key = _answer_cache_key(user_query, temperature, current_vectorstore)
+    
+    def token_iter():
+        if not current_vectorstore:
+            response_text = "Please upload a PDF document first."
+            yield _sse_frame(response_text)
+        else:
+            response_text = _get_cached_answer(cache_key)
+            if response_text is not None:
+                yield _sse_frame(response_text)
+            else:
+                def on_answer(answer: str):
+                    _cache_answer_if_current(cache_key, answer, current_vectorstore)
+                
+                parts = []
+                # Only answers that came from the streamer reach on_answer; fallback and error text is not cached
+                for token in stream_question(current_vectorstore, user_query, temperature, on_answer=on_answer):
+                    parts.append(token)
+                    yield _sse_frame(token)
+                response_text = "".join(parts).strip()
+        
+        chat_history.append(f"user ({credentials}): {user_query}")
+        chat_history.append(f"bot: {response_text}")
+        yield _sse_frame("", event="end")
+    
+    # Starlette iterates sync generators in a threadpool, keeping the event loop free
+    return StreamingResponse(token_iter(), media_type="text/event-stream")
+
 # ✅ File Upload Endpoint
 @app.post("/upload", response_model=UploadStatus)
 async def upload_file(
@@ -152,6 +353,7 @@ async def upload_file(
     Returns:
         UploadStatus: Status of the upload and processing
     """
+    file_location = None
     try:
         logger.info(f"Received file upload request from {credentials}: {file.filename}")
         
@@ -160,42 +362,39 @@ async def upload_file(
             logger.warning(f"Invalid file type uploaded: {file.filename}")
             return {"filename": file.filename or "unknown", "status": "Error: Only PDF files are allowed"}
         
-        # Save uploaded file
-        file_location = f"temp_{file.filename}"
+        # Save uploaded file to a unique path so concurrent uploads of the same filename don't share it
+        fd, file_location = tempfile.mkstemp(prefix="upload_", suffix=".pdf")
+        os.close(fd)
         logger.info(f"Saving file to {file_location}")
-        with open(file_location, "wb") as buffer:
-            buffer.write(await file.read())
+        async with aiofiles.open(file_location, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await buffer.write(chunk)
         
-        # Process PDF and build vectorstore
+        # Process PDF and build vectorstore off the event loop so other requests keep being served
         logger.info("Extracting text from PDF...")
-        text = extract_text_from_pdf(file_location)
+        text = await asyncio.to_thread(extract_text_from_pdf, file_location)
         
         if not text or not text.strip():
             logger.warning("No text extracted from PDF")
-            os.remove(file_location)
             return {"filename": file.filename, "status": "Error: No text could be extracted from the PDF"}
         
         logger.info("Building vectorstore...")
-        global vectorstore
-        vectorstore = build_vectorstore(text)
+        vectorstore = await _load_document(text)
         
         if vectorstore is None:
             logger.error("Failed to build vectorstore")
-            os.remove(file_location)
             return {"filename": file.filename, "status": "Error: Failed to process the document"}
         
-        # Clean up temporary file
-        os.remove(file_location)
         logger.info("File processed successfully")
         
         return {"filename": file.filename, "status": "Uploaded and processed successfully"}
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
-        # Clean up temporary file if it exists
-        file_location = f"temp_{file.filename}"
-        if os.path.exists(file_location):
-            os.remove(file_location)
         return {"filename": file.filename, "status": f"Error: {str(e)}"}
+    finally:
+        # Clean up temporary file
+        if file_location is not None and os.path.exists(file_location):
+            os.remove(file_location)
 
 # ✅ History Endpoint
 @app.get("/history")
@@ -240,7 +439,7 @@ async def status(credentials: str = Depends(authenticate_user)):
     logger.info(f"Status endpoint called by {credentials}")
     return {
         "status": "running",
-        "document_loaded": vectorstore is not None,
+        "document_loaded": app.state.vectorstore is not None,
         "history_length": len(chat_history),
         "user": credentials
     }
@@ -1,24 +1,114 @@
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+from collections import OrderedDict
+from threading import Lock
+from typing import List
+import hashlib
+import numpy as np
+import torch
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EMBEDDINGS_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDINGS_BATCH_SIZE = 64
+EMBEDDINGS_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+EMBEDDINGS_CACHE_SIZE = 10000
+
+# Shared embeddings model, loaded on first use
+_embeddings = None
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that memoizes vectors by the SHA-256 of their text.
+    
+    Repeated chunks and queries are served from a bounded LRU cache; only
+    texts that miss are sent to the model, in a single batched encode call.
+    """
+
+    def __init__(self, embeddings: HuggingFaceEmbeddings, max_entries: int = EMBEDDINGS_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        # Uploads embed in a worker thread while chats embed on the event loop
+        self._lock = Lock()
+
+    @property
+    def tokenizer(self):
+        """Tokenizer of the underlying SentenceTransformer model."""
+        return self.embeddings.client.tokenizer
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts in batches, reusing cached vectors.
+        
+        Args:
+            texts (List[str]): Texts to embed
+            
+        Returns:
+            np.ndarray: Normalized float32 embeddings, one row per text
+        """
+        keys = [self._key(text) for text in texts]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    vectors[key] = self._cache[key]
+        
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        
+        if missing:
+            logger.info(f"Embedding {len(missing)} uncached of {len(texts)} texts")
+            encoded = self.embeddings.client.encode(
+                list(missing.values()),
+                batch_size=EMBEDDINGS_BATCH_SIZE,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            with self._lock:
+                for key, vector in zip(missing, encoded):
+                    vectors[key] = vector
+                    self._cache[key] = vector
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        
+        return np.stack([vectors[key] for key in keys]).astype("float32", copy=False)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
 def get_embeddings():
     """
-    Initialize and return HuggingFace embeddings model.
+    Return the shared HuggingFace embeddings model, initializing it on first call.
     
     Returns:
-        HuggingFaceEmbeddings: Initialized embeddings model or None if failed
+        CachedEmbeddings: Initialized embeddings model or None if failed
     """
+    global _embeddings
+    if _embeddings is not None:
+        return _embeddings
     try:
-        logger.info("Initializing HuggingFace embeddings model...")
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
+        logger.info(f"Initializing HuggingFace embeddings model on {EMBEDDINGS_DEVICE}...")
+        _embeddings = CachedEmbeddings(HuggingFaceEmbeddings(
+            model_name=EMBEDDINGS_MODEL_NAME,
+            model_kwargs={"device": EMBEDDINGS_DEVICE}
+        ))
         logger.info("HuggingFace embeddings model initialized successfully")
-        return embeddings
+        return _embeddings
     except Exception as e:
         logger.error(f"Error initializing embeddings: {e}")
         return None
\ No newline at end of file
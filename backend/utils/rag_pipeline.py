@@ -1,20 +1,163 @@
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.llms import HuggingFacePipeline
-from transformers import pipeline
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, TextIteratorStreamer
+from collections import OrderedDict
+from threading import Lock, Thread
+from typing import Callable, Iterator, List, Optional
+import faiss
+import numpy as np
+import torch
+import hashlib
+import os
 import logging
-from .embeddings import get_embeddings
+from .embeddings import get_embeddings, EMBEDDINGS_MODEL_NAME
+from .semantic_cache import SemanticCache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def build_vectorstore(text: str):
+LLM_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# The larger model is only worth its cost on a GPU; CPU workers keep the small one in FP32
+LLM_MODEL_NAME = "google/flan-t5-base" if LLM_DEVICE == "cuda" else "google/flan-t5-small"
+# T5 overflows in float16, so half precision means bfloat16 only
+LLM_DTYPE = torch.bfloat16 if LLM_DEVICE == "cuda" and torch.cuda.is_bf16_supported() else torch.float32
+
+# Model weights are loaded once per worker; temperature is applied at generate time
+_llm_model = None
+_llm_tokenizer = None
+# Concurrent first requests must not each load a copy of the weights
+_llm_load_lock = Lock()
+
+# Improved prompt engineering for clearer answers.
+# The prompt is kept as fixed segments around the per-query context and question,
+# with the instructions first, so the static parts are byte-identical across calls.
+PROMPT_PREFIX = """Use the following context to answer the question at the end. 
+If you cannot answer the question based on the context, say "I cannot answer that question based on the provided document."
+If the question is unrelated to the document content, say "That question is not related to the content of the uploaded document."
+
+Context:
+"""
+PROMPT_QUESTION = "\n\nQuestion: "
+PROMPT_SUFFIX = "\n\nAnswer:"
+
+# flan-t5 was trained on inputs of up to 512 tokens; longer prompts cost more and answer worse
+LLM_MAX_INPUT_TOKENS = 512
+
+# Token IDs of the static prompt segments, tokenized once when the LLM loads
+_prompt_prefix_ids: List[int] = []
+_prompt_question_ids: List[int] = []
+_prompt_suffix_ids: List[int] = []
+
+def _load_llm_model():
+    """
+    Load the LLM weights and tokenizer once and reuse them across requests.
+    
+    Returns:
+        tuple: (model, tokenizer)
+    """
+    global _llm_model, _llm_tokenizer, _prompt_prefix_ids, _prompt_question_ids, _prompt_suffix_ids
+    if _llm_model is not None and _llm_tokenizer is not None:
+        return _llm_model, _llm_tokenizer
+    with _llm_load_lock:
+        if _llm_model is None or _llm_tokenizer is None:
+            logger.info(f"Loading {LLM_MODEL_NAME} weights on {LLM_DEVICE} ({LLM_DTYPE})...")
+            tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_NAME)
+            _prompt_prefix_ids, _prompt_question_ids, _prompt_suffix_ids = tokenizer(
+                [PROMPT_PREFIX, PROMPT_QUESTION, PROMPT_SUFFIX], add_special_tokens=False
+            ).input_ids
+            _prompt_suffix_ids = _prompt_suffix_ids + [tokenizer.eos_token_id]
+            model = AutoModelForSeq2SeqLM.from_pretrained(LLM_MODEL_NAME, torch_dtype=LLM_DTYPE).to(LLM_DEVICE)
+            model.eval()
+            _llm_model, _llm_tokenizer = model, tokenizer
+            logger.info(f"{LLM_MODEL_NAME} weights loaded successfully")
+    return _llm_model, _llm_tokenizer
+
+# Switch from exact search to HNSW above this many chunks
+HNSW_MIN_CHUNKS = 2000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+def _create_index(vectors: np.ndarray):
+    """
+    Create a scalar-quantized FAISS index suited to the number of vectors.
+    
+    Small documents use exact search over float16 codes (half the memory of float32);
+    large ones use HNSW over 8-bit codes (a quarter of the memory) for sub-linear retrieval.
+    
+    Args:
+        vectors (np.ndarray): Embeddings that will be added, used to train the quantizer
+        
+    Returns:
+        faiss.Index: Trained, empty FAISS index
+    """
+    num_vectors, dim = vectors.shape
+    if num_vectors <= HNSW_MIN_CHUNKS:
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    else:
+        logger.info(f"Using HNSW index for {num_vectors} vectors")
+        index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    index.train(vectors)
+    return index
+
+# Chunks are measured in embedding-model tokens and sized to MiniLM's 256-token
+# window (minus [CLS]/[SEP]), so each chunk is embedded whole without truncation
+CHUNK_SIZE = 254
+CHUNK_OVERLAP = 32
+
+# Token-aware splitter, built once from the embeddings model's tokenizer
+_text_splitter = None
+
+# Number of chunks retrieved as context for each question; two ~254-token chunks
+# already fill most of the LLM's input window
+RETRIEVAL_K = 2
+
+# Built indexes are saved under VECTORSTORE_DIR/<document hash>/
+VECTORSTORE_DIR = os.getenv("VECTORSTORE_DIR", "indexes")
+
+# Recently used vectorstores kept in memory, keyed by document hash
+_VECTORSTORE_CACHE_SIZE = 8
+_vectorstore_cache: "OrderedDict[str, FAISS]" = OrderedDict()
+
+def document_hash(text: str) -> str:
+    """
+    Return the key a document's vectorstore is cached under.
+    
+    The embedding model and chunking settings are part of the hash so changing
+    them doesn't reuse indexes built with the old ones.
+    """
+    key = f"{EMBEDDINGS_MODEL_NAME}|{CHUNK_SIZE}|{CHUNK_OVERLAP}|tokens|{text}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+def _get_text_splitter(embeddings) -> RecursiveCharacterTextSplitter:
+    """Return the shared splitter that sizes chunks by embedding-model tokens."""
+    global _text_splitter
+    if _text_splitter is None:
+        _text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            embeddings.tokenizer, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+        )
+    return _text_splitter
+
+def _remember_vectorstore(doc_hash: str, vectorstore) -> None:
+    _vectorstore_cache[doc_hash] = vectorstore
+    _vectorstore_cache.move_to_end(doc_hash)
+    if len(_vectorstore_cache) > _VECTORSTORE_CACHE_SIZE:
+        _vectorstore_cache.popitem(last=False)
+
+def build_vectorstore(text: str, doc_hash: Optional[str] = None):
     """
     Build a FAISS vectorstore from text using HuggingFace embeddings.
     
+    Vectorstores are cached by document hash, in memory and on disk, so
+    re-uploading a document skips chunking, embedding and indexing.
+    
     Args:
         text (str): Text to build vectorstore from
+        doc_hash (str, optional): Precomputed document_hash(text), to avoid hashing twice
         
     Returns:
         FAISS: Vectorstore object or None if failed
@@ -23,10 +166,34 @@ def build_vectorstore(text: str):
         if not text or not text.strip():
             logger.warning("Empty text provided for vectorstore creation")
             return None
+        
+        doc_hash = doc_hash or document_hash(text)
+        if doc_hash in _vectorstore_cache:
+            logger.info(f"Reusing in-memory vectorstore for document {doc_hash}")
+            _vectorstore_cache.move_to_end(doc_hash)
+            return _vectorstore_cache[doc_hash]
+        
+        logger.info("Initializing embeddings...")
+        embeddings = get_embeddings()
+        
+        # Handle case where embeddings initialization failed
+        if embeddings is None:
+            logger.error("Failed to initialize embeddings")
+            return None
+        
+        index_path = os.path.join(VECTORSTORE_DIR, doc_hash)
+        if os.path.isdir(index_path):
+            try:
+                logger.info(f"Loading saved vectorstore from {index_path}")
+                # load_local unpickles the docstore, so VECTORSTORE_DIR must only be writable by this service
+                vectorstore = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+                _remember_vectorstore(doc_hash, vectorstore)
+                return vectorstore
+            except Exception as e:
+                logger.warning(f"Failed to load saved vectorstore, rebuilding: {e}")
             
         logger.info("Initializing text splitter...")
-        # Use smaller chunk size for better context retrieval
-        splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=50)
+        splitter = _get_text_splitter(embeddings)
         chunks = splitter.split_text(text)
         
         if not chunks:
@@ -35,49 +202,155 @@ def build_vectorstore(text: str):
             
         logger.info(f"Created {len(chunks)} chunks from text")
         
-        logger.info("Initializing embeddings...")
-        embeddings = get_embeddings()
+        logger.info(f"Embedding {len(chunks)} chunks...")
+        vectors = embeddings.encode(chunks)
         
-        # Handle case where embeddings initialization failed
-        if embeddings is None:
-            logger.error("Failed to initialize embeddings")
-            return None
-            
         logger.info("Building FAISS vectorstore...")
-        vectorstore = FAISS.from_texts(chunks, embeddings)
+        vectorstore = FAISS(
+            embedding_function=embeddings,
+            index=_create_index(vectors),
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={}
+        )
+        vectorstore.add_embeddings(list(zip(chunks, vectors)))
         logger.info("FAISS vectorstore built successfully")
+        
+        try:
+            vectorstore.save_local(index_path)
+            logger.info(f"Saved vectorstore to {index_path}")
+        except Exception as e:
+            logger.warning(f"Failed to save vectorstore: {e}")
+        _remember_vectorstore(doc_hash, vectorstore)
         return vectorstore
     except Exception as e:
         logger.error(f"Error building vectorstore: {e}")
         return None
 
-def get_llm(temperature: float = 0.1):
+def _generation_kwargs(temperature: float) -> dict:
+    """Generation settings shared by the blocking and streaming paths."""
+    kwargs = {
+        "max_length": 300,  # Increased max length for more detailed answers
+    }
+    # generate() ignores temperature under greedy decoding, so sample whenever one is given
+    if temperature > 0:
+        kwargs["do_sample"] = True
+        kwargs["temperature"] = temperature
+    return kwargs
+
+def get_llm():
     """
-    Initialize and return HuggingFace LLM.
+    Return the shared HuggingFace LLM, loading it on first call.
     
-    Args:
-        temperature (float): Temperature for text generation (lower for more precise answers)
-        
     Returns:
-        HuggingFacePipeline: Initialized LLM or None if failed
+        tuple: (model, tokenizer) or None if failed
     """
     try:
-        logger.info(f"Initializing HuggingFace LLM with temperature {temperature}...")
-        # Using a smaller, local model for better reliability
-        pipe = pipeline(
-            "text2text-generation",
-            model="google/flan-t5-small",
-            max_length=300,  # Increased max length for more detailed answers
-            temperature=temperature
-        )
-        llm = HuggingFacePipeline(pipeline=pipe)
-        logger.info("HuggingFace LLM initialized successfully")
-        return llm
+        return _load_llm_model()
     except Exception as e:
         logger.error(f"Error initializing LLM: {e}")
         return None
 
-def ask_question(vectorstore, query: str, temperature: float = 0.1):
+def _encode_prompt(model, tokenizer, context: str, query: str) -> torch.Tensor:
+    """
+    Build the prompt as token IDs, splicing the per-query parts between the pre-tokenized static segments.
+    
+    Only the context and question are tokenized per call. The context is truncated
+    so the whole prompt fits in LLM_MAX_INPUT_TOKENS.
+    """
+    context_ids, query_ids = tokenizer([context, query], add_special_tokens=False).input_ids
+    context_budget = LLM_MAX_INPUT_TOKENS - (
+        len(_prompt_prefix_ids) + len(_prompt_question_ids) + len(query_ids) + len(_prompt_suffix_ids)
+    )
+    if len(context_ids) > context_budget:
+        logger.info(f"Truncating context from {len(context_ids)} to {max(context_budget, 0)} tokens")
+        context_ids = context_ids[:max(context_budget, 0)]
+    input_ids = _prompt_prefix_ids + context_ids + _prompt_question_ids + query_ids + _prompt_suffix_ids
+    return torch.tensor([input_ids], device=model.device)
+
+def _generate(model, tokenizer, input_ids: torch.Tensor, temperature: float,
+              streamer: Optional[TextIteratorStreamer] = None) -> str:
+    """
+    Generate an answer from prompt token IDs.
+    
+    Returns:
+        str: Decoded answer
+    """
+    with torch.inference_mode():
+        output_ids = model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            streamer=streamer,
+            **_generation_kwargs(temperature)
+        )
+    return tokenizer.decode(output_ids[0], skip_special_tokens=True)
+
+def _get_semantic_cache(vectorstore, temperature: float, dim: int) -> SemanticCache:
+    """
+    Return the semantic cache for a vectorstore and temperature, creating it on first use.
+    
+    Caches live on the vectorstore so they are discarded with the document.
+    """
+    caches = getattr(vectorstore, "_semantic_caches", None)
+    if caches is None:
+        caches = {}
+        vectorstore._semantic_caches = caches
+    key = round(temperature, 2)
+    if key not in caches:
+        caches[key] = SemanticCache(dim)
+    return caches[key]
+
+def _prepare_context(vectorstore, query: str, temperature: float):
+    """
+    Run the retrieval half of the RAG pipeline shared by ask_question and stream_question.
+    
+    Args:
+        vectorstore: FAISS vectorstore containing document embeddings
+        query (str): Question to ask
+        temperature (float): Temperature for text generation
+        
+    Returns:
+        tuple: (answer, context, semantic_cache, query_vector). answer is set when the
+        question is settled without generation (cache hit or missing context);
+        otherwise context holds the retrieved context for the prompt.
+    """
+    if not vectorstore:
+        logger.warning("No vectorstore provided")
+        return "No document has been processed yet. Please upload a PDF document first.", None, None, None
+    
+    logger.info(f"Processing query: {query}")
+    
+    # Embed the query once; the vector serves both the semantic cache and retrieval
+    query_vector = vectorstore.embedding_function.embed_query(query)
+    semantic_cache = _get_semantic_cache(vectorstore, temperature, len(query_vector))
+    cached_answer = semantic_cache.lookup(query_vector)
+    if cached_answer is not None:
+        return cached_answer, None, None, None
+    
+    logger.info("Retrieving relevant documents...")
+    
+    # Search with the query embedding computed above instead of re-embedding the query
+    docs = vectorstore.similarity_search_by_vector(query_vector, k=RETRIEVAL_K)
+    
+    if not docs:
+        logger.warning("No relevant documents found for query")
+        return "I couldn't find relevant information in the document to answer your question. Please try rephrasing or ask about content that might be in the document.", None, None, None
+    
+    logger.info(f"Retrieved {len(docs)} relevant documents")
+    
+    # Combine context from multiple documents with source indicators.
+    # docs is non-empty here and every part carries a "Source N:" label, so the context is never blank.
+    context = "\n\n".join(f"Source {i}: {doc.page_content}" for i, doc in enumerate(docs, 1))
+    logger.info(f"Retrieved context with {len(context)} characters from {len(docs)} documents")
+    
+    return None, context, semantic_cache, query_vector
+
+def _is_cacheable_answer(response: str) -> bool:
+    """Generic refusals are returned to the user but not reused for similar queries."""
+    lowered = response.lower()
+    return not (lowered.startswith("i don't know") or lowered.startswith("i cannot"))
+
+def ask_question(vectorstore, query: str, temperature: float = 0.1,
+                 on_answer: Optional[Callable[[str], None]] = None):
     """
     Ask a question using the RAG pipeline with improved prompt engineering.
     
@@ -85,69 +358,36 @@ def ask_question(vectorstore, query: str, temperature: float = 0.1):
         vectorstore: FAISS vectorstore containing document embeddings
         query (str): Question to ask
         temperature (float): Temperature for text generation (lower for more precise answers)
+        on_answer: Called with the answer only when the LLM generated it, never for
+            fallback or error messages, so callers can cache it safely
         
     Returns:
         str: Answer to the question
     """
     try:
-        if not vectorstore:
-            logger.warning("No vectorstore provided")
-            return "No document has been processed yet. Please upload a PDF document first."
-        
-        logger.info(f"Processing query: {query}")
-        logger.info("Retrieving relevant documents...")
-        
-        # Use a more precise retriever with higher k value for better context
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
-        docs = retriever.get_relevant_documents(query)
-        
-        if not docs:
-            logger.warning("No relevant documents found for query")
-            return "I couldn't find relevant information in the document to answer your question. Please try rephrasing or ask about content that might be in the document."
-        
-        logger.info(f"Retrieved {len(docs)} relevant documents")
-        
-        # Combine context from multiple documents with source indicators
-        context_parts = []
-        for i, doc in enumerate(docs):
-            context_parts.append(f"Source {i+1}: {doc.page_content}")
-        
-        context = "\n\n".join(context_parts)
-        logger.info(f"Retrieved context with {len(context)} characters from {len(docs)} documents")
-        
-        if not context.strip():
-            logger.warning("Retrieved context is empty")
-            return "The document doesn't contain relevant information to answer your question. Please try asking about different content."
+        answer, context, semantic_cache, query_vector = _prepare_context(vectorstore, query, temperature)
+        if answer is not None:
+            return answer
         
         logger.info("Initializing LLM...")
-        llm = get_llm(temperature)
+        llm = get_llm()
         if not llm:
             logger.error("Failed to initialize LLM")
             return "Sorry, I'm having trouble processing your request right now. Please try again in a moment."
-        
-        # Improved prompt engineering for clearer answers
-        prompt = f"""Use the following context to answer the question at the end. 
-If you cannot answer the question based on the context, say "I cannot answer that question based on the provided document."
-If the question is unrelated to the document content, say "That question is not related to the content of the uploaded document."
-
-Context:
-{context}
-
-Question: {query}
-
-Answer:"""
+        model, tokenizer = llm
         
         logger.info("Generating response from LLM...")
-        response = llm(prompt)
+        input_ids = _encode_prompt(model, tokenizer, context, query)
+        response = _generate(model, tokenizer, input_ids, temperature)
         logger.info("Response generated successfully")
         
         # Post-process the response for better clarity
         if response and response.strip():
-            # Remove any generic model responses
-            if response.strip().lower().startswith("i don't know") or response.strip().lower().startswith("i cannot"):
-                return response.strip()
-            
             # Ensure the response is relevant and clear
+            if _is_cacheable_answer(response.strip()):
+                semantic_cache.add(query_vector, response.strip())
+            if on_answer is not None:
+                on_answer(response.strip())
             return response.strip()
         else:
             logger.warning("LLM returned empty response")
@@ -155,4 +395,78 @@ Answer:"""
             
     except Exception as e:
         logger.error(f"Error processing question: {e}")
-        return f"I encountered an error while processing your question: {str(e)}. Please try rephrasing your question."
\ No newline at end of file
+        return f"I encountered an error while processing your question: {str(e)}. Please try rephrasing your question."
+
+def stream_question(vectorstore, query: str, temperature: float = 0.1,
+                    on_answer: Optional[Callable[[str], None]] = None) -> Iterator[str]:
+    """
+    Ask a question using the RAG pipeline, yielding the answer as it is generated.
+    
+    Generation runs in a background thread feeding a TextIteratorStreamer, so text
+    is yielded token by token. Cached and fallback answers are yielded in one piece.
+    
+    Args:
+        vectorstore: FAISS vectorstore containing document embeddings
+        query (str): Question to ask
+        temperature (float): Temperature for text generation (lower for more precise answers)
+        on_answer: Called with the full answer once the streamer finishes, only when
+            generation succeeded, never for fallback or error messages
+        
+    Yields:
+        str: Pieces of the answer
+    """
+    try:
+        answer, context, semantic_cache, query_vector = _prepare_context(vectorstore, query, temperature)
+        if answer is not None:
+            yield answer
+            return
+        
+        llm = get_llm()
+        if not llm:
+            logger.error("Failed to initialize LLM")
+            yield "Sorry, I'm having trouble processing your request right now. Please try again in a moment."
+            return
+        model, tokenizer = llm
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        input_ids = _encode_prompt(model, tokenizer, context, query)
+        
+        generation_errors = []
+        
+        def run_generation():
+            try:
+                _generate(model, tokenizer, input_ids, temperature, streamer=streamer)
+            except Exception as e:
+                logger.error(f"Error generating streamed response: {e}")
+                generation_errors.append(e)
+                # Unblock the consumer loop below
+                streamer.end()
+        
+        logger.info("Streaming response from LLM...")
+        thread = Thread(target=run_generation)
+        thread.start()
+        
+        parts = []
+        for token in streamer:
+            if token:
+                parts.append(token)
+                yield token
+        thread.join()
+        
+        if generation_errors:
+            # Whatever was streamed before the failure is partial; don't cache it
+            raise generation_errors[0]
+        logger.info("Response streamed successfully")
+        
+        response = "".join(parts).strip()
+        if not response:
+            logger.warning("LLM returned empty response")
+            yield "I couldn't generate a specific answer to your question based on the document. Please try rephrasing your question."
+            return
+        if _is_cacheable_answer(response):
+            semantic_cache.add(query_vector, response)
+        if on_answer is not None:
+            on_answer(response)
+            
+    except Exception as e:
+        logger.error(f"Error streaming question: {e}")
+        yield f"I encountered an error while processing your question: {str(e)}. Please try rephrasing your question."
\ No newline at end of file
@@ -0,0 +1,71 @@
+import faiss
+import numpy as np
+import logging
+from threading import Lock
+from typing import List, Optional, Sequence
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """
+    Cache of answers keyed by query embedding.
+
+    Queries are stored as L2-normalized vectors in a FAISS inner-product index,
+    so a lookup returns the cached answer of the most similar previous query
+    when its cosine similarity is above the threshold.
+    """
+
+    def __init__(self, dim: int, threshold: float = 0.95, max_entries: int = 1024):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.index = faiss.IndexFlatIP(dim)
+        self.answers: List[str] = []
+        # Streaming chats look up and add from threadpool workers; keep index and answers in step
+        self._lock = Lock()
+
+    @staticmethod
+    def _prepare(query_vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(query_vector, dtype="float32").reshape(1, -1).copy()
+        faiss.normalize_L2(vector)
+        return vector
+
+    def lookup(self, query_vector: Sequence[float]) -> Optional[str]:
+        """
+        Return the cached answer for a near-duplicate query, if any.
+
+        Args:
+            query_vector: Embedding of the incoming query
+
+        Returns:
+            str: Cached answer or None on a miss
+        """
+        vector = self._prepare(query_vector)
+        with self._lock:
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(vector, 1)
+            if ids[0][0] >= 0 and scores[0][0] > self.threshold:
+                answer = self.answers[ids[0][0]]
+            else:
+                return None
+        logger.info(f"Semantic cache hit (similarity {scores[0][0]:.3f})")
+        return answer
+
+    def add(self, query_vector: Sequence[float], answer: str) -> None:
+        """
+        Store an answer for a query embedding.
+
+        Args:
+            query_vector: Embedding of the answered query
+            answer (str): Answer to return for similar queries
+        """
+        vector = self._prepare(query_vector)
+        with self._lock:
+            if self.index.ntotal >= self.max_entries:
+                logger.info("Semantic cache full, resetting")
+                self.index.reset()
+                self.answers.clear()
+            self.index.add(vector)
+            self.answers.append(answer)